@@ -1,18 +1,56 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, func, ForeignKey
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session
-from passlib.context import CryptContext
+from sqlalchemy import event, insert, select, text, Column, Integer, String, Float, DateTime, func, ForeignKey, Index
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from jose import jwt
-from datetime import datetime, timedelta
-from typing import Optional
+from jose.backends import HMACKey
+try:
+ from jose.backends.cryptography_backend import CryptographyHMACKey
+except ImportError:
+ CryptographyHMACKey = None
+from datetime import datetime
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from cachetools import TTLCache
+import asyncio
+import bcrypt
+import gzip
+import hashlib
+import math
+import multiprocessing
+import os
+import time
+import timeit
 import uvicorn
+try:
+ import brotli
+except ImportError:
+ brotli = None
 # ---------- DB setup ----------
-SQLALCHEMY_DATABASE_URL = "sqlite:///./exp.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./exp.db"
+# keep a handful of SQLite connections open instead of reopening the db/wal/shm files per request
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=AsyncAdaptedQueuePool, pool_size=5, max_overflow=10, pool_pre_ping=True)
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_conn, _):
+ cursor = dbapi_conn.cursor()
+ # WAL + NORMAL: readers don't block the writer and commits skip the extra fsync while staying crash-safe
+ cursor.execute("PRAGMA journal_mode=WAL")
+ cursor.execute("PRAGMA synchronous=NORMAL")
+ cursor.execute("PRAGMA cache_size=-64000")
+ cursor.execute("PRAGMA temp_store=MEMORY")
+ # map up to 256 MB of the db file for reads, and wait on a locked writer instead of failing with "database is locked"
+ cursor.execute("PRAGMA mmap_size=268435456")
+ cursor.execute("PRAGMA busy_timeout=5000")
+ cursor.close()
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 class User(Base):
  __tablename__ = "users"
@@ -23,87 +61,204 @@ class User(Base):
 class Expense(Base):
  __tablename__ = "expenses"
  id = Column(Integer, primary_key=True, index=True)
- category = Column(String, index=True, nullable=False)
+ category = Column(String, nullable=False)
  amount = Column(Float, nullable=False)
  comments = Column(String, nullable=True)
  created_at = Column(DateTime, server_default=func.now(), nullable=False)
  updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
  owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
  owner = relationship("User", back_populates="expenses")
-Base.metadata.create_all(bind=engine)
-def get_db():
- db = SessionLocal()
- try:
+ # match the list query shape (owner, newest first)
+ __table_args__ = (Index("ix_expenses_owner_created", "owner_id", created_at.desc()),)
+class CategoryTotal(Base):
+ # per-user running totals for /expenses/summary, maintained by the triggers below
+ __tablename__ = "category_totals"
+ owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+ category = Column(String, primary_key=True)
+ total = Column(Float, nullable=False)
+ entries = Column(Integer, nullable=False)
+# SQLite triggers rather than mapper events so Core/text() writes to expenses are counted too
+_TOTALS_ADD = "INSERT INTO category_totals (owner_id, category, total, entries) VALUES (NEW.owner_id, NEW.category, NEW.amount, 1) ON CONFLICT (owner_id, category) DO UPDATE SET total = total + excluded.total, entries = entries + 1;"
+_TOTALS_SUB = "UPDATE category_totals SET total = total - OLD.amount, entries = entries - 1 WHERE owner_id = OLD.owner_id AND category = OLD.category; DELETE FROM category_totals WHERE owner_id = OLD.owner_id AND category = OLD.category AND entries <= 0;"
+_TOTALS_DDL = [
+ f"CREATE TRIGGER IF NOT EXISTS expenses_totals_ins AFTER INSERT ON expenses BEGIN {_TOTALS_ADD} END",
+ f"CREATE TRIGGER IF NOT EXISTS expenses_totals_del AFTER DELETE ON expenses BEGIN {_TOTALS_SUB} END",
+ f"CREATE TRIGGER IF NOT EXISTS expenses_totals_upd AFTER UPDATE OF owner_id, category, amount ON expenses BEGIN {_TOTALS_SUB} {_TOTALS_ADD} END",
+ # once the triggers exist the table is only empty when there are no expenses, so this backfills a pre-existing db exactly once
+ "INSERT INTO category_totals (owner_id, category, total, entries) SELECT owner_id, category, SUM(amount), COUNT(*) FROM expenses WHERE NOT EXISTS (SELECT 1 FROM category_totals) GROUP BY owner_id, category",
+]
+# create_all skips tables that already exist, so bring the expenses indexes of an older db up to date here
+_INDEX_DDL = [
+ "CREATE INDEX IF NOT EXISTS ix_expenses_owner_created ON expenses (owner_id, created_at DESC)",
+ "DROP INDEX IF EXISTS ix_expenses_category",
+]
+@event.listens_for(Base.metadata, "after_create")
+def create_totals_triggers(target, connection, **kw):
+ for ddl in _INDEX_DDL + _TOTALS_DDL:
+     connection.execute(text(ddl))
+# hot-path statements built once at import instead of per request
+_USER_BY_ID_SQL = text("SELECT id, email FROM users WHERE id=:uid")
+_LIST_SQL = text("SELECT id, category, amount, comments, created_at, updated_at FROM expenses WHERE owner_id=:oid ORDER BY created_at DESC").columns(created_at=DateTime, updated_at=DateTime)
+_DELETE_SQL = text("DELETE FROM expenses WHERE id=:id AND owner_id=:oid")
+# totals are running float sums, so round in SQL to keep add/delete drift out of the chart
+_SUMMARY_SQL = text("SELECT category, ROUND(total, 2) FROM category_totals WHERE owner_id=:oid ORDER BY category")
+async def get_db():
+ async with SessionLocal() as db:
      yield db
- finally:
-     db.close()
 # ---------- Auth setup ----------
 SECRET_KEY = "change-this-in-production"
 ALGORITHM = "HS256"
+# HS256 must go through OpenSSL (python-jose[cryptography], pinned in requirements.txt), not the native fallback
+if CryptographyHMACKey is None or HMACKey is not CryptographyHMACKey:
+ raise RuntimeError("python-jose is not using the cryptography backend; install python-jose[cryptography]")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost is picked once at startup so a single hash takes about this long;
+# set the BCRYPT_ROUNDS environment variable to a fixed int to skip the calibration.
+BCRYPT_TARGET_SECONDS = 0.1
+BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS = 10, 15
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+def _pick_bcrypt_rounds(target: float = BCRYPT_TARGET_SECONDS) -> int:
+ # every extra round doubles the work, so one cheap sample is enough to extrapolate
+ probe = 8
+ salt = bcrypt.gensalt(rounds=probe)
+ elapsed = timeit.timeit(lambda: bcrypt.hashpw(b"calibrate", salt), number=1)
+ rounds = probe + math.ceil(math.log2(target / elapsed)) if elapsed > 0 else BCRYPT_MAX_ROUNDS
+ return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS") or _pick_bcrypt_rounds())
+# export the cost so processes that re-import this module (hash pool, uvicorn workers) reuse it instead of recalibrating
+os.environ["BCRYPT_ROUNDS"] = str(BCRYPT_ROUNDS)
+# bcrypt is pure CPU; run it off the event loop so one login doesn't stall every other request.
+# WEB_CONCURRENCY is the number of uvicorn workers (uvicorn reads the same variable); the cores are
+# split between them so N workers don't each start N hash processes.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY") or 1)
+HASH_POOL_WORKERS = max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+# spawn rather than the Linux default fork: the pool starts lazily from a process that already runs threads
+HASH_POOL = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
 def hash_password(p: str) -> str:
- return pwd_context.hash(p)
+ # bcrypt only looks at the first 72 bytes; truncate explicitly as newer bindings reject longer input
+ return bcrypt.hashpw(p.encode()[:72], bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 def verify_password(plain: str, hashed: str) -> bool:
- return pwd_context.verify(plain, hashed)
+ return bcrypt.checkpw(plain.encode()[:72], hashed.encode())
 def create_access_token(data: dict, minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
- to_encode = data.copy()
- to_encode.update({"exp": datetime.utcnow() + timedelta(minutes=minutes)})
+ to_encode = {**data, "exp": int(time.time()) + minutes * 60}
  return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-def current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+# token -> (user id, exp) and user id -> email, so authenticated calls skip the HMAC and the users SELECT
+# current_user runs on the event loop (it is async), so the caches need no lock
+_USER_CACHE = TTLCache(maxsize=10_000, ttl=30)
+@lru_cache(maxsize=10_000)
+def _decode_token(token: str) -> Tuple[int, float]:
+ payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+ return int(payload.get("sub")), payload["exp"]
+def forget_user(uid: int) -> None:
+ # invalidation hook for logout, password change and account deletion. None of those routes exist yet, so
+ # nothing calls this; new ones must, or a removed user stays authenticated for up to the 30s TTL
+ _USER_CACHE.pop(uid, None)
+# FastAPI resolves each dependency once per request (use_cache=True is the default), so
+# get_db and current_user are shared by everything in a request that depends on them. Keep that default,
+# and pass use_cache=True explicitly when nesting these in sub-router dependencies.
+async def current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
    try:
-       payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-       uid = int(payload.get("sub"))
+       uid, exp = _decode_token(token)
    except Exception:
        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-   user = db.query(User).filter(User.id == uid).first()
-   if not user:
+   # decoded tokens are cached, so expiry has to be re-checked here
+   if exp <= time.time():
+       raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+   email = _USER_CACHE.get(uid)
+   if email is not None:
+       return User(id=uid, email=email)
+   row = (await db.execute(_USER_BY_ID_SQL, {"uid": uid})).first()
+   if not row:
        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-   return user
+   _USER_CACHE[uid] = row.email
+   return User(id=row.id, email=row.email)
 # ---------- FastAPI app ----------
-app = FastAPI(title="Expense Tracker (Single File)")
+async def init_db():
+ # create missing tables (and the category_totals triggers); not atomic across processes, so run it once
+ async with engine.begin() as conn:
+     await conn.run_sync(Base.metadata.create_all)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+ # `python app.py` creates the schema before starting its workers; a plain `uvicorn app:app` does it here
+ if not os.environ.get("EXPENSE_TRACKER_SCHEMA_READY"):
+     await init_db()
+ yield
+ HASH_POOL.shutdown(wait=False, cancel_futures=True)
+ await engine.dispose()
+app = FastAPI(title="Expense Tracker (Single File)", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 # ---------- Auth routes ----------
 @app.post("/auth/signup")
-def signup(email: str, password: str, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.email == email).first():
-        raise HTTPException(status_code=400, detail="Email already registered")
-    user = User(email=email, hashed_password=hash_password(password))
+async def signup(email: str, password: str, db: AsyncSession = Depends(get_db)):
+    hashed = await asyncio.get_running_loop().run_in_executor(HASH_POOL, hash_password, password)
+    user = User(email=email, hashed_password=hashed)
+    # the unique index on email is the duplicate check; no SELECT-then-INSERT race
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"id": user.id, "email": user.email}
 @app.post("/auth/login")
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
- user = db.query(User).filter(User.email == form.username).first()
- if not user or not verify_password(form.password, user.hashed_password):
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+ user = (await db.execute(select(User).where(User.email == form.username))).scalars().first()
+ if not user or not await asyncio.get_running_loop().run_in_executor(HASH_POOL, verify_password, form.password, user.hashed_password):
      raise HTTPException(status_code=400, detail="Incorrect email or password")
  token = create_access_token({"sub": str(user.id)})
  return {"access_token": token, "token_type": "bearer"}
 # ---------- Expense routes ----------
 @app.post("/expenses/")
-def add_expense(category: str, amount: float, comments: Optional[str] = None, db: Session = Depends(get_db), user: User = Depends(current_user)):
+async def add_expense(category: str, amount: float, comments: Optional[str] = None, db: AsyncSession = Depends(get_db), user: User = Depends(current_user)):
     exp = Expense(category=category, amount=amount, comments=comments, owner_id=user.id)
     db.add(exp)
-    db.commit()
-    db.refresh(exp)
+    await db.commit()
+    # pick up the server-side created_at/updated_at defaults
+    await db.refresh(exp)
     return exp
-@app.get("/expenses/")
-def list_expenses(db: Session = Depends(get_db), user: User = Depends(current_user)):
-    return db.query(Expense).filter(Expense.owner_id == user.id).order_by(Expense.created_at.desc()).all()
+class ExpenseIn(BaseModel):
+    category: str
+    amount: float
+    comments: Optional[str] = None
+# response models for the hot read routes: current FastAPI serializes these straight to JSON bytes via
+# Pydantic instead of running jsonable_encoder + json.dumps
+class ExpenseOut(BaseModel):
+    id: int
+    category: str
+    amount: float
+    comments: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+class SummaryOut(BaseModel):
+    labels: List[str]
+    data: List[float]
+@app.post("/expenses/bulk")
+async def add_expenses_bulk(items: List[ExpenseIn], db: AsyncSession = Depends(get_db), user: User = Depends(current_user)):
+    # one executemany-style INSERT and a single commit for the whole batch
+    if items:
+        await db.execute(insert(Expense), [{"category": e.category, "amount": e.amount, "comments": e.comments, "owner_id": user.id} for e in items])
+        await db.commit()
+    return {"inserted": len(items)}
+@app.get("/expenses/", response_model=List[ExpenseOut])
+async def list_expenses(db: AsyncSession = Depends(get_db), user: User = Depends(current_user)):
+    # plain rows instead of Expense instances: no identity map or relationship setup for a read-only list
+    return [dict(r) for r in (await db.execute(_LIST_SQL, {"oid": user.id})).mappings()]
 @app.delete("/expenses/{exp_id}")
-def delete_expense(exp_id: int, db: Session = Depends(get_db), user: User = Depends(current_user)):
- exp = db.query(Expense).filter(Expense.id == exp_id, Expense.owner_id == user.id).first()
- if not exp:
+async def delete_expense(exp_id: int, db: AsyncSession = Depends(get_db), user: User = Depends(current_user)):
+ # a single DELETE; rowcount tells us whether the expense existed and belonged to this user
+ result = await db.execute(_DELETE_SQL, {"id": exp_id, "oid": user.id})
+ if result.rowcount == 0:
      raise HTTPException(status_code=404, detail="Expense not found")
- db.delete(exp)
- db.commit()
+ await db.commit()
  return {"ok": True}
-@app.get("/expenses/summary")
-def summary(db: Session = Depends(get_db), user: User = Depends(current_user)):
-    rows = db.query(Expense.category, func.sum(Expense.amount)).filter(Expense.owner_id == user.id).group_by(Expense.category).all()
-    return {"labels": [r[0] for r in rows], "data": [r[1] for r in rows]}
+@app.get("/expenses/summary", response_model=SummaryOut)
+async def summary(db: AsyncSession = Depends(get_db), user: User = Depends(current_user)):
+    rows = (await db.execute(_SUMMARY_SQL, {"oid": user.id})).all()
+    if not rows:
+        return {"labels": [], "data": []}
+    # no list() copies here: SummaryOut validation accepts the tuples
+    labels, data = zip(*rows)
+    return {"labels": labels, "data": data}
 # ---------- Frontend ----------
 INDEX_HTML = """
 <!doctype html>
@@ -146,8 +301,57 @@ let chart;function pie(){api("/expenses/summary").then(d=>{if(chart)chart.destro
 </body>
 </html>
 """
-@app.get("/", response_class=HTMLResponse)
-def home():
- return INDEX_HTML
+# the page never changes at runtime: encode, compress, hash and build every response variant once
+_INDEX_BYTES = INDEX_HTML.encode("utf-8")
+_INDEX_DIGEST = hashlib.md5(_INDEX_BYTES).hexdigest()
+def _index_variant(body: bytes, encoding: Optional[str]) -> Tuple[str, Response, Response]:
+ etag = '"%s-%s"' % (_INDEX_DIGEST, encoding) if encoding else '"%s"' % _INDEX_DIGEST
+ headers = {"Cache-Control": "public, max-age=3600", "ETag": etag, "Vary": "Accept-Encoding"}
+ full = Response(content=body, media_type="text/html", headers={**headers, "Content-Encoding": encoding} if encoding else headers)
+ return etag, full, Response(status_code=304, headers=headers)
+# most preferred first; identity is always available. mtime=0 keeps the gzip bytes identical across workers,
+# as the strong ETag promises
+_INDEX_VARIANTS = [("gzip", _index_variant(gzip.compress(_INDEX_BYTES, 9, mtime=0), "gzip"))]
+if brotli is not None:
+ _INDEX_VARIANTS.insert(0, ("br", _index_variant(brotli.compress(_INDEX_BYTES, quality=11), "br")))
+_INDEX_IDENTITY = _index_variant(_INDEX_BYTES, None)
+def _encoding_qvalues(header: str) -> dict:
+ # Accept-Encoding -> {encoding: q}; elements look like "gzip", "br;q=0.8" or "* ; q=0"
+ qvalues = {}
+ for part in header.split(","):
+     name, *params = [p.strip() for p in part.split(";")]
+     if not name:
+         continue
+     q = 1.0
+     for param in params:
+         key, _, value = param.partition("=")
+         if key.strip().lower() == "q":
+             try:
+                 q = float(value.strip())
+             except ValueError:
+                 q = 0.0
+     qvalues[name.lower()] = q
+ return qvalues
+def _accepts(qvalues: dict, encoding: str) -> bool:
+ # "*" stands in for every encoding the client didn't list
+ return qvalues.get(encoding, qvalues.get("*", 0.0)) > 0
+@app.get("/", response_class=Response)
+def home(request: Request):
+ qvalues = _encoding_qvalues(request.headers.get("accept-encoding", ""))
+ etag, full, not_modified = next((v for enc, v in _INDEX_VARIANTS if _accepts(qvalues, enc)), _INDEX_IDENTITY)
+ if request.headers.get("if-none-match") == etag:
+     return not_modified
+ return full
 if __name__ == "__main__":
- uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+ async def _init_db_once():
+     await init_db()
+     await engine.dispose()
+ asyncio.run(_init_db_once())
+ # workers inherit the environment, so none of them race on create_all
+ os.environ["EXPENSE_TRACKER_SCHEMA_READY"] = "1"
+ # production settings: uvloop/httptools ("auto" picks them when installed; uvloop has no Windows build),
+ # one worker per core (override with WEB_CONCURRENCY), no reloader
+ # and no access log. The bcrypt cost was calibrated once above and reaches the workers via BCRYPT_ROUNDS.
+ # for local development use `uvicorn app:app --reload` instead.
+ os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1))
+ uvicorn.run("app:app", host="0.0.0.0", port=8000, loop="auto", http="auto", workers=int(os.environ["WEB_CONCURRENCY"]), log_level="warning", access_log=False)
\ No newline at end of file